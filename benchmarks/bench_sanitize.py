@@ -0,0 +1,132 @@
+"""LLM 输入脱敏的吞吐量基准：单次扫描实现 vs 旧的六次 re.sub 实现。
+
+运行前先逐条核对 EQUIVALENCE_CASES：结果应与旧实现相同，或与记录的已知差异相同。
+需要在安装了 AstrBot 的环境中运行（会导入插件的 main 模块）：
+
+    python benchmarks/bench_sanitize.py [--size-mb 1] [--repeat 5]
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import iter_sanitized_lines, sanitize_text_for_llm  # noqa: E402
+
+
+def legacy_sanitize(text: str) -> str:
+    """旧实现：六次独立的 re.sub。"""
+    text = re.sub(r"\b(?:https?|ftp)://\S+", "[URL]", text, flags=re.IGNORECASE)
+    text = re.sub(r"\bwww\.\S+", "[URL]", text, flags=re.IGNORECASE)
+    text = re.sub(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b", "[EMAIL]", text)
+    text = re.sub(r"\bsk-[A-Za-z0-9]{10,}\b", "[SECRET]", text)
+    text = re.sub(r"\bBearer\s+[A-Za-z0-9._-]{10,}\b", "Bearer [SECRET]", text, flags=re.IGNORECASE)
+    text = re.sub(r"(?<!\d)1\d{10}(?!\d)", "[PHONE]", text)
+    return text
+
+
+SAMPLE_LINES = [
+    "[2024-05-01 10:00:00]「张三」: 今天下午三点开会，记得带上周报",
+    "[2024-05-01 10:00:05]「李四」: 资料在 https://example.com/docs/report?id=42 里",
+    "[2024-05-01 10:00:09]「王五」: 有问题发邮件到 someone.name+tag@example.org",
+    "[2024-05-01 10:00:12]「赵六」: 我的手机号 13812345678，晚上联系",
+    "[2024-05-01 10:00:20]「钱七」: 测试用的 key 是 sk-abcdefghijklmnop1234，别外传",
+    "[2024-05-01 10:00:31]「孙八」: 好的收到，大家辛苦了 👍",
+    "[2024-05-01 10:00:40]「周九」: 参考 www.example.net/page 上的说明",
+]
+
+
+# (输入, 单次扫描的预期输出；None 表示应与旧实现相同)
+# 旧实现先替换全文的 URL、再替换邮箱……；单次扫描按位置从左到右匹配，较早开始的匹配优先。
+EQUIVALENCE_CASES = [
+    ("资料在 https://example.com/docs?id=42 里", None),
+    ("参考 www.example.net/page 上的说明", None),
+    ("发邮件到 someone.name+tag@example.org", None),
+    ("https://example.com/u/someone@example.org", None),
+    ("13812345678@qq.com", None),
+    ("我的手机号 13812345678，晚上联系", None),
+    ("编号 913812345678 不是手机号", None),
+    ("key 是 sk-abcdefghijklmnop1234，别外传", None),
+    ("Authorization: Bearer abcdefghij.klmnop", None),
+    # 令牌换行：逐行版本需要把行尾的 Bearer 与下一行合并
+    ("Authorization: Bearer\nabcdefghij.klmnop 其余内容", None),
+    ("Bearer\n\n  abcdefghijklmnop\nwww.example.com", None),
+    # 已知差异：旧实现输出 user@[URL]，邮箱前缀未脱敏
+    ("user@www.example.com", "[EMAIL]"),
+    # 已知差异：旧实现输出 john.[URL]
+    ("john.www.site@example.com", "[EMAIL]"),
+    # 已知差异：旧实现先替换邮箱，输出 Bearer [EMAIL]
+    ("Bearer abcdefghijklmn@example.com", "Bearer [SECRET]@example.com"),
+]
+
+
+def sanitize_streamed(text: str) -> str:
+    return "\n".join(iter_sanitized_lines(text.splitlines()))
+
+
+def check_equivalence() -> bool:
+    ok = True
+    for text, expected in EQUIVALENCE_CASES:
+        legacy = legacy_sanitize(text)
+        wanted = legacy if expected is None else expected
+        for label, func in (("single pass", sanitize_text_for_llm), ("streamed", sanitize_streamed)):
+            actual = func(text)
+            if actual != wanted:
+                ok = False
+                print(
+                    f"mismatch ({label}): {text!r}\n"
+                    f"  legacy   {legacy!r}\n  expected {wanted!r}\n  actual   {actual!r}"
+                )
+    print(f"equivalence: {len(EQUIVALENCE_CASES)} cases, {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+def build_input(size_bytes: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size_bytes:
+        line = rng.choice(SAMPLE_LINES)
+        lines.append(line)
+        total += len(line.encode("utf-8")) + 1
+    return "\n".join(lines)
+
+
+def measure(label: str, func, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - started)
+    size_mb = len(text.encode("utf-8")) / (1024 * 1024)
+    print(f"{label:<24} best {best * 1000:8.2f} ms   {size_mb / best:8.2f} MB/s")
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if not check_equivalence():
+        sys.exit(1)
+
+    text = build_input(int(args.size_mb * 1024 * 1024))
+    print(f"input: {len(text.encode('utf-8'))} bytes, {text.count(chr(10)) + 1} lines")
+
+    legacy = measure("legacy (6 x re.sub)", legacy_sanitize, text, args.repeat)
+    single = measure("single pass", sanitize_text_for_llm, text, args.repeat)
+    measure("streamed by line", sanitize_streamed, text, args.repeat)
+    print(f"speedup (single pass vs legacy): {legacy / single:.2f}x")
+
+    if sanitize_text_for_llm(text) != legacy_sanitize(text):
+        print("warning: outputs differ from the legacy implementation on this input")
+
+
+if __name__ == "__main__":
+    main()